@@ -1,12 +1,11 @@
-import sqlalchemy
-from sqlalchemy.orm.session import sessionmaker
-
-
 class DBClient:
 
     def __init__(self, db_url) -> None:
+        import sqlalchemy
+        from sqlalchemy.orm.session import sessionmaker
+
         self.db_url = db_url
-        self.engine = sqlalchemy.create_engine(db_url)
+        self.engine = sqlalchemy.create_engine(db_url, pool_pre_ping=True)
         self.metadata = sqlalchemy.MetaData(bind=self.engine)
         self.session_factory = sessionmaker(bind=self.engine)
         self.tables = {}
@@ -17,6 +16,16 @@ class DBClient:
     def session(self):
         return self.session_factory()
 
+    def ping(self):
+        import sqlalchemy
+
+        with self.engine.connect() as connection:
+            connection.execute(sqlalchemy.text("SELECT 1"))
+
+    def dispose(self, close: bool = True):
+        # close=False drops pooled connections inherited from a parent process without closing them under it
+        self.engine.dispose(close=close)
+
     def drop_all(self):
         self.metadata.reflect()
         self.session_factory.close_all()
@@ -38,3 +47,4 @@ class ContextManager:
             self.session.commit()
         else:
             self.session.rollback()
+        self.session.close()
@@ -0,0 +1,136 @@
+"""
+create label stats tables
+
+Revision ID: 5c0e4f7a9b21
+Down revision ID: 12ade287ead0
+Created date: 2026-10-19 09:42:11.503817+00:00
+"""
+
+import sqlalchemy as sa
+import alembic.op as op
+
+
+revision = '5c0e4f7a9b21'
+down_revision = '12ade287ead0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("searches", sa.Column("total_pages", sa.BigInteger, nullable=True))
+
+    op.create_table(
+        "search_label_stats",
+        sa.Column("search_id", sa.BigInteger, sa.ForeignKey("searches.id"), primary_key=True),
+        sa.Column("num_labeled", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("num_positive", sa.BigInteger, nullable=False, server_default="0"),
+    )
+    op.create_table(
+        "user_label_stats",
+        sa.Column("user_id", sa.BigInteger, primary_key=True),
+        sa.Column("num_labeled", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("num_positive", sa.BigInteger, nullable=False, server_default="0"),
+        sa.Column("last_labeled_at", sa.DateTime(timezone=True)),
+    )
+    op.create_table(
+        "user_label_minutes",
+        sa.Column("user_id", sa.BigInteger, primary_key=True),
+        sa.Column("minute", sa.DateTime(timezone=True), primary_key=True),
+        sa.Column("num_labeled", sa.BigInteger, nullable=False, server_default="0"),
+    )
+    op.create_index("ix_user_label_minutes_minute", "user_label_minutes", ["minute"])
+
+    # covering indexes for the backfill below, the dataset export and any remaining per-search/per-user scans,
+    # built concurrently outside the migration transaction so labeling is not blocked while they build
+    with op.get_context().autocommit_block():
+        op.create_index("ix_images_search_id_label", "images", ["search_id", "label"], postgresql_concurrently=True)
+        op.create_index(
+            "ix_images_user_id_collected_at", "images", ["user_id", "collected_at"],
+            postgresql_include=["label"], postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_images_collected_at", "images", ["collected_at"],
+            postgresql_include=["label", "search_id"], postgresql_concurrently=True,
+        )
+
+    # keep the summary tables in step with images inside the labeling transaction itself
+    op.execute(
+        """
+            CREATE FUNCTION update_label_stats() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    UPDATE search_label_stats
+                    SET num_labeled = num_labeled - 1, num_positive = num_positive - (OLD.label > 0)::int
+                    WHERE search_id = OLD.search_id;
+                    UPDATE user_label_stats
+                    SET num_labeled = num_labeled - 1, num_positive = num_positive - (OLD.label > 0)::int
+                    WHERE user_id = OLD.user_id;
+                    UPDATE user_label_minutes
+                    SET num_labeled = num_labeled - 1
+                    WHERE user_id = OLD.user_id AND minute = date_trunc('minute', COALESCE(OLD.collected_at, NOW()));
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO search_label_stats(search_id, num_labeled, num_positive)
+                    VALUES (NEW.search_id, 1, (NEW.label > 0)::int)
+                    ON CONFLICT (search_id) DO UPDATE SET
+                        num_labeled = search_label_stats.num_labeled + 1,
+                        num_positive = search_label_stats.num_positive + EXCLUDED.num_positive;
+                    INSERT INTO user_label_stats(user_id, num_labeled, num_positive, last_labeled_at)
+                    VALUES (NEW.user_id, 1, (NEW.label > 0)::int, NEW.collected_at)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        num_labeled = user_label_stats.num_labeled + 1,
+                        num_positive = user_label_stats.num_positive + EXCLUDED.num_positive,
+                        last_labeled_at = GREATEST(user_label_stats.last_labeled_at, EXCLUDED.last_labeled_at);
+                    INSERT INTO user_label_minutes(user_id, minute, num_labeled)
+                    VALUES (NEW.user_id, date_trunc('minute', COALESCE(NEW.collected_at, NOW())), 1)
+                    ON CONFLICT (user_id, minute) DO UPDATE SET
+                        num_labeled = user_label_minutes.num_labeled + 1;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """
+    )
+    # block label inserts until the trigger exists so the backfill does not miss or double count rows
+    op.execute("LOCK TABLE images IN SHARE ROW EXCLUSIVE MODE")
+    op.execute(
+        """
+            CREATE TRIGGER images_update_label_stats
+            AFTER INSERT OR DELETE OR UPDATE OF label, user_id, search_id, collected_at ON images
+            FOR EACH ROW EXECUTE PROCEDURE update_label_stats()
+        """
+    )
+    op.execute(
+        """
+            INSERT INTO search_label_stats(search_id, num_labeled, num_positive)
+            SELECT search_id, COUNT(*), COUNT(*) FILTER (WHERE label > 0)
+            FROM images GROUP BY search_id
+        """
+    )
+    op.execute(
+        """
+            INSERT INTO user_label_stats(user_id, num_labeled, num_positive, last_labeled_at)
+            SELECT user_id, COUNT(*), COUNT(*) FILTER (WHERE label > 0), MAX(collected_at)
+            FROM images GROUP BY user_id
+        """
+    )
+    op.execute(
+        """
+            INSERT INTO user_label_minutes(user_id, minute, num_labeled)
+            SELECT user_id, date_trunc('minute', collected_at), COUNT(*)
+            FROM images WHERE collected_at IS NOT NULL GROUP BY user_id, date_trunc('minute', collected_at)
+        """
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER images_update_label_stats ON images")
+    op.execute("DROP FUNCTION update_label_stats()")
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_images_collected_at", "images", postgresql_concurrently=True)
+        op.drop_index("ix_images_user_id_collected_at", "images", postgresql_concurrently=True)
+        op.drop_index("ix_images_search_id_label", "images", postgresql_concurrently=True)
+    op.drop_table("user_label_minutes")
+    op.drop_table("user_label_stats")
+    op.drop_table("search_label_stats")
+    op.drop_column("searches", "total_pages")
@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from db.client import DBClient
+
+from .flickr import ImageDownloader
+from .label import LabelImagesController, DatabaseInterface
+from .mirror import GCSFileUploader, LocalFileStore
+from .stats import LabelStatsInterface
+
+BUFFER_SIZE = 5
+SHUTDOWN_TIMEOUT = 5.0
+
+
+class AppServices:
+    """
+    Lazily builds the clients used by the app, once per process.
+
+    Nothing is created at import time, so a forked worker never inherits clients, connection
+    pools or threads from its parent. If the pid changes, the inherited state is dropped and
+    rebuilt on first use in the child. The labeling session itself is per-process state, so the
+    app must still run with a single worker.
+    """
+
+    def __init__(self, app: Flask):
+        self._app = app
+        self._logger: logging.Logger = app.logger
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._executor: ThreadPoolExecutor = None
+        self._file_store: LocalFileStore = None
+        self._image_uploader: GCSFileUploader = None
+        self._db_client: DBClient = None
+        self._flickr_downloader: ImageDownloader = None
+        self._labeler: DatabaseInterface = None
+        self._stats: LabelStatsInterface = None
+        self._controller: LabelImagesController = None
+        self._warm_up_thread: threading.Thread = None
+        self._ready = threading.Event()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            if self._db_client is not None:
+                self._db_client.dispose(close=False)
+            self._reset()
+
+    @property
+    def download_path(self) -> str:
+        return self._app.config["LOCAL_DOWNLOAD_PATH"]
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        self._check_pid()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flickr-app-buffer")
+            return self._executor
+
+    @property
+    def file_store(self) -> LocalFileStore:
+        self._check_pid()
+        with self._lock:
+            if self._file_store is None:
+                self._file_store = LocalFileStore(upload_prefix=self.download_path, logger=self._logger)
+            return self._file_store
+
+    @property
+    def image_uploader(self) -> GCSFileUploader:
+        self._check_pid()
+        with self._lock:
+            if self._image_uploader is None:
+                self._image_uploader = GCSFileUploader(
+                    logger=self._logger,
+                    project_name=self._app.config["GCP_PROJECT"],
+                    bucket_name=self._app.config["GCP_BUCKET"],
+                    auth_json_path=self._app.config["GOOGLE_APPLICATION_CREDENTIALS"],
+                    executor=self.executor,
+                )
+            return self._image_uploader
+
+    @property
+    def db_client(self) -> DBClient:
+        self._check_pid()
+        with self._lock:
+            if self._db_client is None:
+                self._db_client = DBClient(self._app.config["FLICKR_APP_DB_URL"])
+            return self._db_client
+
+    @property
+    def flickr_downloader(self) -> ImageDownloader:
+        self._check_pid()
+        with self._lock:
+            if self._flickr_downloader is None:
+                self._flickr_downloader = ImageDownloader(
+                    logger=self._logger,
+                    api_key=self._app.config["FLICKR_API_KEY"],
+                    api_secret=self._app.config["FLICKR_API_SECRET"],
+                    temp_file_mirror=self.file_store,
+                    file_mirror=self.image_uploader,
+                )
+            return self._flickr_downloader
+
+    @property
+    def labeler(self) -> DatabaseInterface:
+        self._check_pid()
+        with self._lock:
+            if self._labeler is None:
+                self._labeler = DatabaseInterface(db_client=self.db_client, logger=self._logger)
+            return self._labeler
+
+    @property
+    def stats(self) -> LabelStatsInterface:
+        self._check_pid()
+        with self._lock:
+            if self._stats is None:
+                self._stats = LabelStatsInterface(db_client=self.db_client, logger=self._logger)
+            return self._stats
+
+    @property
+    def controller(self) -> LabelImagesController:
+        self._check_pid()
+        with self._lock:
+            if self._controller is None:
+                self._controller = LabelImagesController(
+                    download_path=self.download_path,
+                    image_downloader=self.flickr_downloader,
+                    dataset_interface=self.labeler,
+                    download_buffer_size=BUFFER_SIZE,
+                )
+            return self._controller
+
+    @property
+    def ready(self) -> bool:
+        self._check_pid()
+        return self._ready.is_set()
+
+    def _run_in_app_context(self, fn):
+        def run():
+            with self._app.app_context():
+                return fn()
+        return run
+
+    def _warm_up(self):
+        self._logger.debug("Warming up clients...")
+        try:
+            self.db_client.ping()
+            self.flickr_downloader.flickrapi
+            self.controller.spawn_buffering_process()
+        except Exception:
+            self._logger.exception("Failed to warm up clients")
+            return
+        self._ready.set()
+        self._logger.debug("Done")
+
+    def start_workers(self):
+        """Warm up clients and start the buffering worker in the current process, if not already done."""
+        self._check_pid()
+        with self._lock:
+            if self._ready.is_set() or (self._warm_up_thread is not None and self._warm_up_thread.is_alive()):
+                return
+            self._warm_up_thread = threading.Thread(
+                target=self._run_in_app_context(self._warm_up), name="flickr-app-warm-up", daemon=True,
+            )
+            self._warm_up_thread.start()
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._logger.debug("Shutting down background workers...")
+            if self._controller is not None:
+                self._controller.stop_buffering_process(timeout=SHUTDOWN_TIMEOUT)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            if self._db_client is not None:
+                self._db_client.dispose()
+            self._reset()
+
@@ -1,13 +1,11 @@
 import logging
 import os
-from typing import Iterable, List
-import requests
+from typing import Iterable, List, Tuple
 from flask import current_app
 from concurrent.futures import Future, ThreadPoolExecutor
 import itertools
 
 from .mirror import FileMirror
-from flickrapi import FlickrAPI
 from .util import (
     MAX_TAKEN_DATE,
     PER_PAGE_DEFAULT,
@@ -22,12 +20,20 @@ class ImageDownloader:
     def __init__(self, logger: logging.Logger, api_key: str, api_secret: str, file_mirror: FileMirror, temp_file_mirror: FileMirror):
         self._api_key = api_key
         self._api_secret = api_secret
-        self._flickrapi = FlickrAPI(api_key, api_secret, token_cache_location=os.getenv("FLICKR_CACHE"))
+        self._flickrapi = None
         self._file_mirror = file_mirror
         self._temp_file_mirror = temp_file_mirror
         self._current_search = None
         self._logger = logger
 
+    @property
+    def flickrapi(self):
+        if self._flickrapi is None:
+            from flickrapi import FlickrAPI
+
+            self._flickrapi = FlickrAPI(self._api_key, self._api_secret, token_cache_location=os.getenv("FLICKR_CACHE"))
+        return self._flickrapi
+
     def end_session(self):
         current_app.logger.debug("ImageDownloader - session ended")
         self._current_search = None
@@ -42,7 +48,7 @@ class ImageDownloader:
 
     def _get_download_link(self, photo_id: str, size_label: str = "Original") -> str:
         self._logger.debug(f"Getting download options for photo {photo_id}")
-        sizes = self._flickrapi.photos.getSizes(photo_id=photo_id, format="parsed-json")
+        sizes = self.flickrapi.photos.getSizes(photo_id=photo_id, format="parsed-json")
         self._logger.debug("Done")
         max_size_link = None
         max_size = 0
@@ -62,6 +68,8 @@ class ImageDownloader:
         return f"{photo_id}_{size_label.replace(' ', '_')}.{file_format}"
 
     def download_photo(self, photo_id: str):
+        import requests
+
         link, size = self._get_download_link(photo_id=photo_id)
         self._logger.debug(f"Downloading from {link}...")
         data = requests.get(link, headers={"Content-Type": "image/jpg"}).content
@@ -86,25 +94,29 @@ class ImageDownloader:
         img, size = self.download_photo(photo_id=photo_id)
         return photo_id, *self.save_photo(photo=img, photo_id=photo_id, photo_size=size, file_format=file_format)
     
-    def search_photos(self, search_text: str, per_page: int = PER_PAGE_DEFAULT, page: int = 0, max_taken_date: int = MAX_TAKEN_DATE) -> List[str]:
+    def search_photos(self, search_text: str, per_page: int = PER_PAGE_DEFAULT, page: int = 0, max_taken_date: int = MAX_TAKEN_DATE) -> Tuple[List[str], int]:
         self._logger.debug(f"Searching for photos: '{search_text}', page {page}")
-        photos = self._flickrapi.photos.search(text=search_text, per_page=per_page, page=page + 1, format="parsed-json", max_taken_date=max_taken_date)
+        photos = self.flickrapi.photos.search(text=search_text, per_page=per_page, page=page + 1, format="parsed-json", max_taken_date=max_taken_date)
         self._logger.debug("Done")
-        return [photo["id"] for photo in photos["photos"]["photo"]]
+        return [photo["id"] for photo in photos["photos"]["photo"]], int(photos["photos"]["pages"])
 
-    def iter_photos(self) -> Iterable:
+    def iter_photos(self, start_page: int = None, start_image: int = None) -> Iterable:
         assert self._current_search is not None, "search has not been initializied"
-        page = self._current_search.last_page_idx
-        start_image = self._current_search.last_image_idx
+        # bind the search now rather than on the first next(), the session may have moved on by then
+        search = self._current_search
+        page = search.last_page_idx if start_page is None else start_page
+        start_image = search.last_image_idx if start_image is None else start_image
+        return self._iter_search_photos(search=search, page=page, start_image=start_image)
+
+    def _iter_search_photos(self, search: ImageSearch, page: int, start_image: int) -> Iterable:
         while True:
-            for i, photo_id in enumerate(
-                self.search_photos(
-                    search_text=self._current_search.query,
-                    per_page=self._current_search.per_page,
-                    page=page,
-                    max_taken_date=self._current_search.max_taken_date,
-                )
-            ):
+            photo_ids, search.total_pages = self.search_photos(
+                search_text=search.query,
+                per_page=search.per_page,
+                page=page,
+                max_taken_date=search.max_taken_date,
+            )
+            for i, photo_id in enumerate(photo_ids):
                 if i < start_image:
                     continue
                 yield photo_id, page, i
@@ -0,0 +1,88 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import List
+
+JOURNAL_FILENAME = "buffer_journal.jsonl"
+
+
+@dataclass
+class BufferEntry:
+    flickr_id: str
+    local_path: str
+    remote_path: str
+    page_idx: int
+    image_idx: int
+
+    @property
+    def position(self):
+        return self.page_idx, self.image_idx
+
+
+class BufferJournal:
+    """
+    Append-only on-disk record of the images sitting in the download buffer of a search.
+
+    Every buffered image is appended as an "add" record and dropped with a "remove" record once labeled, so after
+    a restart the buffer can be refilled from images that were already downloaded and uploaded.
+    """
+
+    def __init__(self, path: str, logger: logging.Logger):
+        self._path = path
+        self._logger = logger
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive across threads and processes. Locks a side file, since compaction replaces the journal itself."""
+        with self._lock:
+            with open(self._path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _append(self, record: dict):
+        with self._locked():
+            with open(self._path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add(self, entry: BufferEntry):
+        self._append({"op": "add", **asdict(entry)})
+
+    def remove(self, flickr_id: str):
+        self._append({"op": "remove", "flickr_id": flickr_id})
+
+    def load(self) -> List[BufferEntry]:
+        """Replay the journal into the entries still buffered, in buffer order, and compact it."""
+        entries = {}
+        with self._locked():
+            if not os.path.exists(self._path):
+                return []
+            with open(self._path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a crash mid-write can only truncate the last record
+                        self._logger.warning(f"Skipping corrupt record in {self._path}")
+                        continue
+                    op = record.pop("op")
+                    if op == "add":
+                        entries[record["flickr_id"]] = BufferEntry(**record)
+                    elif op == "remove":
+                        entries.pop(record["flickr_id"], None)
+            with open(self._path + ".tmp", "w+") as f:
+                for entry in entries.values():
+                    f.write(json.dumps({"op": "add", **asdict(entry)}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self._path + ".tmp", self._path)
+        return list(entries.values())
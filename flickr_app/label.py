@@ -1,19 +1,22 @@
-from concurrent.futures import Future, ThreadPoolExecutor
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 import logging
-import time
-from typing import Iterable, Tuple
-from flask import current_app
+import threading
+from typing import Iterable, List, Tuple
+from flask import Flask, current_app
 import os
 import itertools
+from dataclasses import astuple
 
 from db.client import DBClient
-from flickr_app.util import MAX_TAKEN_DATE, ImageSearch, InvalidSearchException, check_future_exception
+from flickr_app.util import MAX_TAKEN_DATE, ImageSearch, InvalidSearchException
 
 from .flickr import (
     ImageDownloader,
     PER_PAGE_DEFAULT,
     IMAGES_SUBDIR,
 )
+from .journal import JOURNAL_FILENAME, BufferEntry, BufferJournal
 from .mirror import FileMirror
 
 
@@ -38,7 +41,7 @@ class DatabaseInterface:
         with self._db_client.transaction() as session:
             result = session.execute(
                 """
-                    SELECT id, per_page, max_taken_date, last_page_idx, last_image_idx
+                    SELECT id, per_page, max_taken_date, last_page_idx, last_image_idx, total_pages
                     FROM searches WHERE query = :query
                     LIMIT 1
                 """,
@@ -52,6 +55,7 @@ class DatabaseInterface:
                     last_page_idx=result["last_page_idx"],
                     per_page=result["per_page"],
                     max_taken_date=result["max_taken_date"],
+                    total_pages=result["total_pages"],
                 )
                 session.execute(
                     "UPDATE searches SET last_search_time = NOW() WHERE id = :id",
@@ -106,8 +110,12 @@ class DatabaseInterface:
                     WITH update_search AS (
                         UPDATE searches
                         SET
-                            last_page_idx = :page_idx,
-                            last_image_idx = :image_idx,
+                            -- never move the cursor backwards when images are labeled out of search order
+                            last_page_idx = CASE WHEN (:page_idx, :image_idx) > (last_page_idx, last_image_idx)
+                                THEN :page_idx ELSE last_page_idx END,
+                            last_image_idx = CASE WHEN (:page_idx, :image_idx) > (last_page_idx, last_image_idx)
+                                THEN :image_idx ELSE last_image_idx END,
+                            total_pages = COALESCE(:total_pages, total_pages),
                             last_search_time = NOW()
                         WHERE id = :search_id
                     )
@@ -124,6 +132,7 @@ class DatabaseInterface:
                     "search_id": search.id,
                     "page_idx": search.last_page_idx,
                     "image_idx": search.last_image_idx,
+                    "total_pages": search.total_pages,
                 }
             ).fetchone()
         return result is not None
@@ -155,22 +164,44 @@ class LabelImagesController:
         self.curr_image_id = None
         self._session_up = False
         self.loading = False
-        self._buffering_process: Future = None
+        self._buffering_process: threading.Thread = None
         self._buffering = False
         self._current_search: ImageSearch = None
         self._buffer_locked = True
+        self._buffer_condition = threading.Condition()
+        self._session_generation = 0
+        self._stopped = False
+        self._journal: BufferJournal = None
 
-    def spawn_buffering_process(self, executor: ThreadPoolExecutor):
-        self._buffering_process = executor.submit(self._buffer_continuously)
-        #self._buffering_process.add_done_callback(check_future_exception)
+    def spawn_buffering_process(self):
+        self._stopped = False
+        # the buffering thread logs through current_app, so hand it the app that spawned it
+        self._buffering_process = threading.Thread(
+            target=self._buffer_continuously,
+            args=(current_app._get_current_object(),),
+            name="image-buffer",
+            daemon=True,
+        )
+        self._buffering_process.start()
+
+    def stop_buffering_process(self, timeout: float = None):
+        with self._buffer_condition:
+            self._stopped = True
+            self._buffer_condition.notify_all()
+        if self._buffering_process is not None:
+            self._buffering_process.join(timeout=timeout)
+            self._buffering_process = None
 
     def end_session(self):
         current_app.logger.debug("LabelImagesController - session ended")
-        if self._session_up:
-            self._buffer_locked
-            self._image_buffer = []
-            self._image_downloader.end_session()
-            self._session_up = False
+        with self._buffer_condition:
+            if self._session_up:
+                self._buffer_locked = True
+                self._session_generation += 1
+                self._image_buffer = []
+                self._images_iter = None
+                self._image_downloader.end_session()
+                self._session_up = False
 
     def new_session(self, search_text: str, user_id: int = 1): # TODO: specify user_id
         self.end_session()
@@ -182,11 +213,52 @@ class LabelImagesController:
         os.makedirs(self._session_download_path, exist_ok=True)
         self._current_search = self._dataset_interface.new_search(search_text)
         self._image_downloader.new_session(download_path=self._session_download_path, search=self._current_search)
-        self._images_iter = self._image_downloader.iter_photos()
-        self._buffer_locked = False
-        self._session_up = True
+        self._journal = BufferJournal(os.path.join(self._session_download_path, JOURNAL_FILENAME), logger=current_app.logger)
+        restored, resume_position = self._restore_buffer()
+        with self._buffer_condition:
+            self._image_buffer = restored
+            self._images_iter = self._image_downloader.iter_photos(*resume_position)
+            self._buffer_locked = False
+            self._session_up = True
+            self._buffer_condition.notify_all()
         self.next_image()
 
+    def _restore_buffer(self) -> Tuple[List[Tuple[str, str, str, int, int]], Tuple[int, int]]:
+        """
+        Refill the buffer from images downloaded for this search before a restart.
+
+        Returns the restored buffer and the (page_idx, image_idx) the Flickr search should resume from.
+        """
+        entries = self._journal.load()
+        restored = []
+        missing_positions = []
+        for entry in sorted(entries, key=lambda entry: entry.position):
+            if not os.path.exists(entry.local_path):
+                current_app.logger.debug(f"Dropping journaled image {entry.flickr_id} because {entry.local_path} is missing")
+                self._journal.remove(entry.flickr_id)
+                missing_positions += [entry.position]
+            elif self._dataset_interface.check_image_labeled(flickr_id=entry.flickr_id):
+                self._journal.remove(entry.flickr_id)
+            else:
+                restored += [astuple(entry)]
+        current_app.logger.debug(f"Restored {len(restored)} images from buffer journal")
+        if missing_positions:
+            # download missing images again; images restored after them are skipped by the buffering thread
+            return restored, min(missing_positions)
+        if entries:
+            page_idx, image_idx = max(entry.position for entry in entries)
+            return restored, (page_idx, image_idx + 1)
+        return restored, (None, None)
+
+    def _insert_into_buffer(self, image: Tuple[str, str, str, int, int]):
+        # keep the buffer in search order: images downloaded again after a restart can be older than restored
+        # ones, and labeling them out of order would move the search cursor backwards
+        positions = [(page_idx, image_idx) for _, _, _, page_idx, image_idx in self._image_buffer]
+        self._image_buffer.insert(bisect.bisect(positions, tuple(image[3:])), image)
+
+    def _is_buffered(self, flickr_id: str) -> bool:
+        return flickr_id == self.curr_image_id or any(image[0] == flickr_id for image in self._image_buffer)
+
     def _download_image_if_not_labeled(self, image_metdata: Tuple[int, int, int]) -> Tuple[int, str, str, int, int]:
         flickr_id, page_idx, image_idx = image_metdata
         if self._dataset_interface.check_image_labeled(flickr_id=flickr_id):
@@ -204,34 +276,76 @@ class LabelImagesController:
         current_app.logger.debug(f"Buffering {num_new_images} images...")
         for flickr_id, local_path, remote_path, page_idx, image_idx in self._download_images(num_new_images):
             if local_path:
-                self._image_buffer += [(flickr_id, local_path, remote_path, page_idx, image_idx)]
+                self._journal.add(BufferEntry(flickr_id, local_path, remote_path, page_idx, image_idx))
+                self._insert_into_buffer((flickr_id, local_path, remote_path, page_idx, image_idx))
                 current_app.logger.debug(f"Image {flickr_id} added to buffer")
             else:
                 current_app.logger.debug(f"Image {flickr_id} skipped because it was already labeled")
 
-    def _buffer_continuously(self):
+    def _buffer_needed(self) -> bool:
+        return (
+            not self._buffer_locked and
+            self._images_iter is not None and
+            self._download_buffer_size > len(self._image_buffer)
+        )
+
+    def _buffer_continuously(self, app: Flask):
+        with app.app_context():
+            self._buffer_until_stopped()
+
+    def _buffer_until_stopped(self):
         while True:
-            if (
-                not self._buffer_locked and
-                self._images_iter is not None and
-                self._download_buffer_size > len(self._image_buffer)
-            ):
-                # TODO: updates not propagating to api call thread somehow (both while True's active)
-                self._image_buffer += [self._download_image_if_not_labeled(next(self._images_iter))]
-            else:
-                time.sleep(0.1)
+            with self._buffer_condition:
+                self._buffer_condition.wait_for(lambda: self._stopped or self._buffer_needed())
+                if self._stopped:
+                    return
+                generation = self._session_generation
+                images_iter = self._images_iter
+                journal = self._journal
+            # download outside of the lock so the request thread can keep popping from the buffer
+            try:
+                image_metadata = next(images_iter)
+            except Exception:
+                # the search iterator is dead after raising, so stop buffering until the next session
+                with self._buffer_condition:
+                    if generation == self._session_generation:
+                        current_app.logger.exception("Failed to search for images")
+                        self._images_iter = None
+                continue
+            with self._buffer_condition:
+                if generation == self._session_generation and self._is_buffered(image_metadata[0]):
+                    continue
+            try:
+                flickr_id, local_path, remote_path, page_idx, image_idx = self._download_image_if_not_labeled(image_metadata)
+            except Exception:
+                current_app.logger.exception(f"Failed to buffer image {image_metadata[0]}")
+                continue
+            if local_path:
+                # journal even if the session changed meanwhile, so the image is reused when its search resumes
+                journal.add(BufferEntry(flickr_id, local_path, remote_path, page_idx, image_idx))
+            with self._buffer_condition:
+                if generation != self._session_generation:
+                    continue
+                if local_path:
+                    self._insert_into_buffer((flickr_id, local_path, remote_path, page_idx, image_idx))
+                    self._buffer_condition.notify_all()
 
     def next_image(self):
         current_app.logger.debug("Attempting to load next image...")
         if not self.loading:
             self.loading = True
-            i = 0
-            while len(self._image_buffer) == 0:
-                if i % 10 == 0:
-                    current_app.logger.debug(f"Waiting on buffer...{i // 10}")
-                i += 1
-                time.sleep(0.1)
-            self.curr_image_id, self.curr_image_path, self._curr_image_remote_path, page_idx, image_idx = self._image_buffer.pop(0)
+            with self._buffer_condition:
+                i = 0
+                while len(self._image_buffer) == 0:
+                    if self._images_iter is None:
+                        current_app.logger.warning("Image buffer is empty and no search is active")
+                        self.loading = False
+                        return
+                    current_app.logger.debug(f"Waiting on buffer...{i}")
+                    i += 1
+                    self._buffer_condition.wait(timeout=1.0)
+                self.curr_image_id, self.curr_image_path, self._curr_image_remote_path, page_idx, image_idx = self._image_buffer.pop(0)
+                self._buffer_condition.notify_all()
             self._current_search.last_page_idx = page_idx
             self._current_search.last_image_idx = image_idx
             current_app.logger.debug(f"Pulled image {self.curr_image_id} from buffer")
@@ -247,4 +361,5 @@ class LabelImagesController:
             label=label,
             search=self._current_search,
         )
+        self._journal.remove(self.curr_image_id)
         self.next_image()
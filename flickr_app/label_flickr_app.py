@@ -1,46 +1,47 @@
+import atexit
 import os
-from flask import Flask, render_template, redirect, request, url_for, send_from_directory, current_app
-from concurrent.futures import ThreadPoolExecutor
-
-from db.client import DBClient
-
-from .flickr import ImageDownloader
-from .label import LabelImagesController, DatabaseInterface
-from .mirror import GCSFileUploader, LocalFileStore
-
-DOWNLOAD_PATH = os.getenv("LOCAL_DOWNLOAD_PATH", "data")
-
-app = Flask(__name__)
-app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
-thread_executor = ThreadPoolExecutor(max_workers=1)
-file_store = LocalFileStore(upload_prefix=DOWNLOAD_PATH, logger=app.logger)
-image_uploader = GCSFileUploader(
-    logger=app.logger,
-    project_name=os.getenv("GCP_PROJECT"),
-    bucket_name=os.getenv("GCP_BUCKET"),
-    auth_json_path=os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
-    executor=thread_executor,
+from dataclasses import asdict
+from flask import Blueprint, Flask, jsonify, render_template, redirect, request, url_for, send_from_directory, current_app
+
+from .app import AppServices
+from .stats import RATE_WINDOW_MINUTES
+
+CONFIG_ENV_VARS = (
+    "GCP_PROJECT",
+    "GCP_BUCKET",
+    "GOOGLE_APPLICATION_CREDENTIALS",
+    "FLICKR_APP_DB_URL",
+    "FLICKR_API_KEY",
+    "FLICKR_API_SECRET",
 )
-db_client = DBClient(os.getenv("FLICKR_APP_DB_URL"))
-flickr_downloader = ImageDownloader(
-    logger=app.logger,
-    api_key=os.getenv("FLICKR_API_KEY"),
-    api_secret=os.getenv("FLICKR_API_SECRET"),
-    temp_file_mirror=file_store,
-    file_mirror=image_uploader,
-)
-labeler = DatabaseInterface(db_client=db_client, logger=app.logger)
-controller = LabelImagesController(
-    download_path=DOWNLOAD_PATH,
-    image_downloader=flickr_downloader,
-    dataset_interface=labeler,
-    download_buffer_size=5,
-)
-controller.spawn_buffering_process(executor=thread_executor)
+
+views = Blueprint("views", __name__)
+
+
+def services() -> AppServices:
+    return current_app.extensions["flickr_app"]
 
 
-@app.route('/', methods=("GET", "POST"))
+def create_app(config: dict = None) -> Flask:
+    app = Flask(__name__)
+    app.logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    app.config["LOCAL_DOWNLOAD_PATH"] = os.getenv("LOCAL_DOWNLOAD_PATH", "data")
+    app.config.update({name: os.getenv(name) for name in CONFIG_ENV_VARS})
+    if config:
+        app.config.update(config)
+    app.register_blueprint(views)
+
+    # clients and background workers are created on first use in each worker process, never at import
+    app_services = AppServices(app)
+    app.extensions["flickr_app"] = app_services
+    app.before_request(app_services.start_workers)
+    atexit.register(app_services.shutdown)
+    return app
+
+
+@views.route('/', methods=("GET", "POST"))
 def label_images_view():
+    controller = services().controller
     return render_template(
         'label_view.html',
         curr_img=controller.curr_image_path,
@@ -50,33 +51,59 @@ def label_images_view():
     )
 
 
-@app.route('/new-search', methods=("GET", "POST"))
+@views.route('/new-search', methods=("GET", "POST"))
 def new_search():
     search_text = request.form["search_text"]
-    controller.new_session(search_text=search_text)
-    return redirect(url_for("label_images_view"))
+    services().controller.new_session(search_text=search_text)
+    return redirect(url_for("views.label_images_view"))
 
 
-@app.route('/label-image', methods=("GET", "POST"))
+@views.route('/label-image', methods=("GET", "POST"))
 def label_image():
     label = request.args.get("label")
+    controller = services().controller
     if controller.curr_image_path and not controller.loading:
         controller.label(label=label)
     else:
         current_app.logger.debug("Skipping label action because image loading is in progress.")
-    return redirect(url_for("label_images_view"))
+    return redirect(url_for("views.label_images_view"))
 
 
-@app.route('/<path:filepath>')
+@views.route('/stats')
+def stats_view():
+    stats = services().stats
+    return render_template(
+        'stats_view.html',
+        searches=stats.search_stats(),
+        users=stats.user_stats(),
+    )
+
+
+@views.route('/api/stats')
+def stats_api():
+    stats = services().stats
+    window_minutes = request.args.get("window_minutes", type=int) or RATE_WINDOW_MINUTES
+    return jsonify(
+        searches=[asdict(search) for search in stats.search_stats()],
+        users=[asdict(user) for user in stats.user_stats(window_minutes=window_minutes)],
+    )
+
+
+@views.route('/<path:filepath>')
 def get_image(filepath: str):
     return send_from_directory("../", filepath, as_attachment=True)
 
 
-@app.route('/ready')
+@views.route('/ready')
 def ready():
+    if not services().ready:
+        return "warming up", 503
     return "ready"
 
 
-@app.route('/live')
+@views.route('/live')
 def live():
     return "live"
+
+
+app = create_app()
@@ -1,7 +1,5 @@
 import logging
 import os
-from google.cloud import storage
-from google.oauth2 import service_account
 from typing import Dict, Union
 from concurrent.futures import ThreadPoolExecutor, Future
 from flask import current_app
@@ -40,6 +38,10 @@ class GCSFileUploader(FileMirror):
         self._project_name = project_name
         self._bucket_name = bucket_name
         self._upload_prefix = upload_prefix
+        # google-cloud-storage is slow to import, so defer it until a client is actually built
+        from google.cloud import storage
+        from google.oauth2 import service_account
+
         credentials = service_account.Credentials.from_service_account_file(
             auth_json_path, scopes=['https://www.googleapis.com/auth/cloud-platform']
         )
@@ -53,6 +55,15 @@ class GCSFileUploader(FileMirror):
             return self._upload_prefix + "/" + upload_path
         return upload_path
 
+    def blob_name(self, public_url: str) -> str:
+        """Inverse of blob.public_url, for the paths stored in the images table."""
+        from urllib.parse import unquote
+
+        bucket_url = f"https://storage.googleapis.com/{self._bucket_name}/"
+        if public_url.startswith(bucket_url):
+            return unquote(public_url[len(bucket_url):])
+        return public_url
+
     def _make_remove_upload_future_callback(self, upload_url: str):
         def remove_upload_future(future: Future):
             future_ = self._upload_futures[upload_url]
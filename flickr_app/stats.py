@@ -0,0 +1,104 @@
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from db.client import DBClient
+
+RATE_WINDOW_MINUTES = 10
+
+
+@dataclass
+class SearchStats:
+    id: int
+    query: str
+    num_labeled: int
+    num_positive: int
+    positive_rate: Optional[float]
+    last_page_idx: int
+    total_pages: Optional[int]
+    remaining_pages: Optional[int]
+
+
+@dataclass
+class UserStats:
+    user_id: int
+    num_labeled: int
+    num_positive: int
+    positive_rate: Optional[float]
+    labels_per_minute: float
+    last_labeled_at: Optional[str]
+
+
+def _rate(numerator: int, denominator: int) -> Optional[float]:
+    return numerator / denominator if denominator else None
+
+
+class LabelStatsInterface:
+    """
+    Reads labeling progress from the summary tables kept up to date by the `update_label_stats` trigger.
+
+    None of these queries touch `images`, so their cost depends on the number of searches, users and
+    recent minutes rather than on the number of labeled images.
+    """
+
+    def __init__(self, db_client: DBClient, logger: logging.Logger):
+        self._db_client = db_client
+        self._logger = logger
+
+    def search_stats(self) -> List[SearchStats]:
+        self._logger.debug("Fetching search stats")
+        with self._db_client.transaction() as session:
+            rows = session.execute(
+                """
+                    SELECT
+                        searches.id, searches.query, searches.last_page_idx, searches.total_pages,
+                        COALESCE(stats.num_labeled, 0) AS num_labeled,
+                        COALESCE(stats.num_positive, 0) AS num_positive
+                    FROM searches LEFT JOIN search_label_stats stats ON stats.search_id = searches.id
+                    ORDER BY searches.last_search_time DESC
+                """
+            ).fetchall()
+        return [
+            SearchStats(
+                id=row["id"],
+                query=row["query"],
+                num_labeled=row["num_labeled"],
+                num_positive=row["num_positive"],
+                positive_rate=_rate(row["num_positive"], row["num_labeled"]),
+                last_page_idx=row["last_page_idx"],
+                total_pages=row["total_pages"],
+                remaining_pages=None if row["total_pages"] is None else max(row["total_pages"] - row["last_page_idx"] - 1, 0),
+            )
+            for row in rows
+        ]
+
+    def user_stats(self, window_minutes: int = RATE_WINDOW_MINUTES) -> List[UserStats]:
+        self._logger.debug("Fetching user stats")
+        with self._db_client.transaction() as session:
+            rows = session.execute(
+                """
+                    SELECT
+                        stats.user_id, stats.num_labeled, stats.num_positive, stats.last_labeled_at,
+                        COALESCE(recent.num_labeled, 0) AS num_recent
+                    FROM user_label_stats stats
+                    LEFT JOIN (
+                        SELECT user_id, SUM(num_labeled) AS num_labeled
+                        FROM user_label_minutes
+                        WHERE minute > date_trunc('minute', NOW()) - make_interval(mins => :window_minutes)
+                        GROUP BY user_id
+                    ) recent ON recent.user_id = stats.user_id
+                    ORDER BY stats.last_labeled_at DESC NULLS LAST
+                """,
+                {"window_minutes": window_minutes},
+            ).fetchall()
+        return [
+            UserStats(
+                user_id=row["user_id"],
+                num_labeled=row["num_labeled"],
+                num_positive=row["num_positive"],
+                positive_rate=_rate(row["num_positive"], row["num_labeled"]),
+                labels_per_minute=row["num_recent"] / window_minutes,
+                last_labeled_at=row["last_labeled_at"] and row["last_labeled_at"].isoformat(),
+            )
+            for row in rows
+        ]
@@ -20,6 +20,7 @@ class ImageSearch:
     last_image_idx: int
     per_page: int = PER_PAGE_DEFAULT
     max_taken_date: int = MAX_TAKEN_DATE
+    total_pages: Optional[int] = None
 
 
 class InvalidSearchException(Exception):
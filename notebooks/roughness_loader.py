@@ -0,0 +1,408 @@
+"""
+CPU data loading for the contrastive roughness model in `Learning Roughness Prediction and Clean Sketch Generation.ipynb`.
+
+Reads a dataset written by `python -m flickr_app.export`, decodes it once into a memory-mapped cache and builds
+(clean, rough) pairs with augmentations modelled on `ImagePairTransform` + `RandomRoughening` (see
+`RoughnessPairAugmentation` for where they differ), vectorized over the batch with NumPy. Batches are built by a pool of worker processes and handed back through shared memory.
+
+    cache = DecodedImageCache("../data/export").build()
+    with RoughnessPairLoader(cache, RoughnessPairAugmentation(size=(224, 224)), batch_size=10) as loader:
+        train_batch = torch.from_numpy(loader.batch())  # (batch_size, 2, 224, 224), clean first
+"""
+import csv
+import io
+import json
+import multiprocessing as mp
+import os
+import queue
+import tarfile
+import traceback
+from collections import defaultdict
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+INDEX_FILENAME = "index.csv"
+CACHE_SUBDIR = "cache"
+IMAGE_SIZE_DEFAULT = 512
+PREFETCH_DEFAULT = 2
+WORKER_POLL_SECONDS = 1.0
+JOIN_TIMEOUT_SECONDS = 5.0
+LABEL_EXTENSIONS = ("cls", "json")
+
+
+def _decode(data: bytes, image_size: int) -> np.ndarray:
+    image = Image.open(io.BytesIO(data)).convert("L")
+    return np.asarray(image.resize((image_size, image_size), Image.BILINEAR), dtype=np.uint8)
+
+
+def _decode_shard(task: Tuple[str, List[str], int]) -> Tuple[List[str], np.ndarray]:
+    shard_path, keys, image_size = task
+    wanted = set(keys)
+    decoded_keys, decoded = [], []
+    with tarfile.open(shard_path) as tar:
+        for member in tar:
+            key, extension = member.name.split(".", 1)
+            if key not in wanted or extension in LABEL_EXTENSIONS:
+                continue
+            decoded_keys += [key]
+            decoded += [_decode(tar.extractfile(member).read(), image_size)]
+    return decoded_keys, np.stack(decoded) if decoded else np.zeros((0, image_size, image_size), np.uint8)
+
+
+class DecodedImageCache:
+    """
+    Grayscale images of an export decoded once into a single (N, image_size, image_size) uint8 .npy memmap.
+
+    Exports only ever append to their index, so rebuilding after an incremental export copies the rows that
+    are already cached and only decodes the new ones.
+    """
+
+    def __init__(self, export_dir: str, image_size: int = IMAGE_SIZE_DEFAULT, cache_dir: str = None):
+        self.export_dir = export_dir
+        self.image_size = image_size
+        cache_dir = cache_dir or os.path.join(export_dir, CACHE_SUBDIR)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"decoded-{image_size}.npy")
+        self._keys_path = os.path.join(cache_dir, f"decoded-{image_size}.json")
+        self.images: np.ndarray = None
+        self.labels: np.ndarray = None
+        self.flickr_ids: np.ndarray = None
+
+    def _read_index(self) -> List[Dict[str, str]]:
+        with open(os.path.join(self.export_dir, INDEX_FILENAME), newline="") as f:
+            return list(csv.DictReader(f))
+
+    def _cached_keys(self) -> List[str]:
+        if not (os.path.exists(self.path) and os.path.exists(self._keys_path)):
+            return []
+        with open(self._keys_path) as f:
+            return json.load(f)
+
+    def _copy_from_arrays(self, rows: Sequence[Dict[str, str]], out: np.ndarray, offset: int) -> List[int]:
+        """Copy rows whose export already has a preresized array of the right size. Returns the rows left to decode."""
+        arrays = {}
+        remaining = []
+        for i, row in enumerate(rows):
+            array_file = row["array_file"]
+            if array_file and array_file not in arrays:
+                array = np.load(os.path.join(self.export_dir, array_file), mmap_mode="r")
+                arrays[array_file] = array if array.shape[1:] == (self.image_size, self.image_size) else None
+            if array_file and arrays[array_file] is not None:
+                out[offset + i] = arrays[array_file][int(row["array_idx"])]
+            else:
+                remaining += [i]
+        return remaining
+
+    def build(self, workers: Optional[int] = None) -> "DecodedImageCache":
+        rows = self._read_index()
+        keys = [row["key"] for row in rows]
+        cached_keys = self._cached_keys()
+        if cached_keys != keys:
+            num_reused = len(cached_keys) if cached_keys == keys[:len(cached_keys)] else 0
+            tmp_path = self.path + ".tmp"
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(len(rows), self.image_size, self.image_size))
+            if num_reused:
+                out[:num_reused] = np.load(self.path, mmap_mode="r")[:num_reused]
+
+            new_rows = rows[num_reused:]
+            by_shard = defaultdict(list)
+            for i in self._copy_from_arrays(new_rows, out, offset=num_reused):
+                by_shard[new_rows[i]["shard"]] += [new_rows[i]["key"]]
+            positions = {key: i for i, key in enumerate(keys)}
+            tasks = [
+                (os.path.join(self.export_dir, shard), shard_keys, self.image_size)
+                for shard, shard_keys in by_shard.items()
+            ]
+            if tasks:
+                with mp.Pool(processes=min(workers or os.cpu_count(), len(tasks))) as pool:
+                    for decoded_keys, decoded in pool.imap_unordered(_decode_shard, tasks):
+                        out[[positions[key] for key in decoded_keys]] = decoded
+            out.flush()
+            del out
+            os.replace(tmp_path, self.path)
+            with open(self._keys_path, "w+") as f:
+                json.dump(keys, f)
+
+        self.images = np.load(self.path, mmap_mode="r")
+        self.labels = np.array([int(row["label"]) for row in rows], dtype=np.int64)
+        self.flickr_ids = np.array([int(row["flickr_id"]) for row in rows], dtype=np.int64)
+        return self
+
+
+class RoughnessPairAugmentation:
+    """
+    Batched NumPy version of the notebook's `ImagePairTransform`, with `RandomRoughening` producing the rough image.
+
+    Takes a batch of clean grayscale sketches and returns (batch, 2, *size) float32 pairs of (clean, rough)
+    crops, inverted so that lines are bright on a zero background. The rough image overlays randomly rotated,
+    scaled and translated copies of the clean crop (`rough_*` parameters). As in `ImagePairTransform`, both
+    images share the crop and then get flips and a `RandomAffine` (`degrees`, `translate`, `scale_range`) that
+    are independent unless `same_transform` is set. Differences from the notebook:
+
+    - images come from a `DecodedImageCache`, so they have been resized to a square, losing their aspect ratio
+      and any resolution beyond `image_size`
+    - crops are resized bilinearly, but the affine transforms sample nearest-neighbour (torchvision's default)
+    """
+
+    def __init__(
+        self,
+        size=(224, 224),
+        scale=(0.1, 1.),
+        ratio=(0.75, 1.3),
+        hflip_ratio=0.5,
+        vflip_ratio=0.5,
+        degrees=(0, 0),
+        translate=(0, 0),
+        scale_range=(1, 1),
+        same_transform=False,
+        overlays=(1, 4),
+        rough_degrees=(-10, 10),
+        rough_translate=(0, 0.1),
+        rough_scale_range=(0.8, 1.2),
+        normalize=False,
+        eps=1e-10,
+    ):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.hflip_ratio = hflip_ratio
+        self.vflip_ratio = vflip_ratio
+        self.degrees = degrees
+        self.translate = translate
+        self.scale_range = scale_range
+        self.same_transform = same_transform
+        self.min_overlays, self.max_overlays = overlays
+        self.rough_degrees = rough_degrees
+        self.rough_translate = rough_translate
+        self.rough_scale_range = rough_scale_range
+        self.normalize = normalize
+        self.eps = eps
+
+    def _random_resized_crop(self, images: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        batch_size, height, width = images.shape
+        area = height * width * rng.uniform(*self.scale, size=batch_size)
+        ratio = np.exp(rng.uniform(np.log(self.ratio[0]), np.log(self.ratio[1]), size=batch_size))
+        crop_w = np.clip(np.rint(np.sqrt(area * ratio)), 1, width)
+        crop_h = np.clip(np.rint(np.sqrt(area / ratio)), 1, height)
+        y0 = np.floor(rng.random(batch_size) * (height - crop_h + 1))
+        x0 = np.floor(rng.random(batch_size) * (width - crop_w + 1))
+        # bilinear resize of each crop to the output size, sampling at output pixel centres
+        ys = y0[:, None] + (np.arange(self.size[0]) + 0.5) * crop_h[:, None] / self.size[0] - 0.5
+        xs = x0[:, None] + (np.arange(self.size[1]) + 0.5) * crop_w[:, None] / self.size[1] - 0.5
+        ys, xs = np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)
+        y_lo, x_lo = np.floor(ys).astype(np.intp), np.floor(xs).astype(np.intp)
+        y_hi, x_hi = np.minimum(y_lo + 1, height - 1), np.minimum(x_lo + 1, width - 1)
+        wy = (ys - y_lo).astype(np.float32)[:, :, None]
+        wx = (xs - x_lo).astype(np.float32)[:, None, :]
+        b = np.arange(batch_size)[:, None, None]
+        images = images.astype(np.float32)
+        top = images[b, y_lo[:, :, None], x_lo[:, None, :]] * (1 - wx) + images[b, y_lo[:, :, None], x_hi[:, None, :]] * wx
+        bottom = images[b, y_hi[:, :, None], x_lo[:, None, :]] * (1 - wx) + images[b, y_hi[:, :, None], x_hi[:, None, :]] * wx
+        return top * (1 - wy) + bottom * wy
+
+    @staticmethod
+    def _flip(images: np.ndarray, flip: np.ndarray, axis: int) -> np.ndarray:
+        return np.where(flip[:, None, None], np.flip(images, axis=axis), images)
+
+    @staticmethod
+    def _affine_params(rng: np.random.Generator, batch_size: int, degrees, translate, scale_range) -> Tuple[np.ndarray, ...]:
+        angle = np.deg2rad(rng.uniform(*degrees, size=batch_size))
+        scale = rng.uniform(*scale_range, size=batch_size)
+        tx = rng.uniform(-translate[0], translate[0], size=batch_size)
+        ty = rng.uniform(-translate[1], translate[1], size=batch_size)
+        return angle, scale, tx, ty
+
+    @staticmethod
+    def _affine(images: np.ndarray, angle: np.ndarray, scale: np.ndarray, tx: np.ndarray, ty: np.ndarray) -> np.ndarray:
+        batch_size, height, width = images.shape
+        angle, scale = angle[:, None, None], scale[:, None, None]
+        cy, cx = (height - 1) / 2, (width - 1) / 2
+        dy = np.arange(height)[None, :, None] - cy - ty[:, None, None] * height
+        dx = np.arange(width)[None, None, :] - cx - tx[:, None, None] * width
+        # map every output pixel back through the inverse transform and sample the nearest source pixel
+        cos, sin = np.cos(angle) / scale, np.sin(angle) / scale
+        src_x = np.rint(cos * dx + sin * dy + cx).astype(np.intp)
+        src_y = np.rint(-sin * dx + cos * dy + cy).astype(np.intp)
+        valid = (src_x >= 0) & (src_x < width) & (src_y >= 0) & (src_y < height)
+        sampled = images[
+            np.arange(batch_size)[:, None, None], np.clip(src_y, 0, height - 1), np.clip(src_x, 0, width - 1)
+        ]
+        return np.where(valid, sampled, 0)
+
+    def _roughen(self, clean: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        batch_size = clean.shape[0]
+        num_overlays = rng.integers(self.min_overlays, self.max_overlays, size=batch_size)
+        rough = clean.copy()
+        for i in range(self.max_overlays - 1):
+            active = i < num_overlays
+            if not active.any():
+                break
+            params = self._affine_params(rng, batch_size, self.rough_degrees, self.rough_translate, self.rough_scale_range)
+            # lines are bright after inverting, so overlaying strokes is a maximum
+            rough = np.where(active[:, None, None], np.maximum(rough, self._affine(clean, *params)), rough)
+        return rough
+
+    def __call__(self, images: np.ndarray, rng: np.random.Generator, out: np.ndarray = None) -> np.ndarray:
+        batch_size = images.shape[0]
+        if out is None:
+            out = np.empty((batch_size, 2, *self.size), dtype=np.float32)
+        clean = (255 - self._random_resized_crop(images, rng)) / 255
+        rough = self._roughen(clean, rng)
+
+        pair = [clean, rough]
+        num_draws = 1 if self.same_transform else 2
+        hflips = [rng.random(batch_size) < self.hflip_ratio for _ in range(num_draws)]
+        vflips = [rng.random(batch_size) < self.vflip_ratio for _ in range(num_draws)]
+        affines = [
+            self._affine_params(rng, batch_size, self.degrees, self.translate, self.scale_range) for _ in range(num_draws)
+        ]
+        for i, image in enumerate(pair):
+            draw = i % num_draws
+            image = self._flip(image, hflips[draw], axis=2)
+            image = self._flip(image, vflips[draw], axis=1)
+            if self.degrees != (0, 0) or self.translate != (0, 0) or self.scale_range != (1, 1):
+                image = self._affine(image, *affines[draw])
+            out[:, i] = image
+        if self.normalize:
+            out /= out.sum(axis=(2, 3), keepdims=True) + self.eps
+        return out
+
+
+def _worker_loop(cache_path, candidates, augmentation, batch_size, shm_name, slots_shape, tasks, done):
+    images = np.load(cache_path, mmap_mode="r")
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            slot, seed = task
+            try:
+                rng = np.random.default_rng(seed)
+                # sorted indices turn the memmap gather into mostly sequential reads
+                idx = np.sort(rng.choice(candidates, size=batch_size))
+                augmentation(np.asarray(images[idx]), rng, out=slots[slot])
+            except Exception:
+                # report the failure instead of dying silently, which would leave `batch()` waiting forever
+                done.put((slot, traceback.format_exc()))
+                return
+            done.put((slot, None))
+    finally:
+        del slots
+        shm.close()
+
+
+class RoughnessPairLoader:
+    """
+    Samples (clean, rough) pair batches from a `DecodedImageCache`.
+
+    With `workers > 0`, batches are built ahead of time by worker processes directly into shared memory slots.
+    The array returned by `batch()` is a view of one of those slots and is only valid until the next call, so
+    copy it if it needs to outlive the training step.
+    """
+
+    def __init__(
+        self,
+        cache: DecodedImageCache,
+        augmentation: RoughnessPairAugmentation,
+        batch_size: int,
+        labels: Sequence[int] = (1,),
+        workers: Optional[int] = None,
+        prefetch: int = PREFETCH_DEFAULT,
+        seed: int = 0,
+    ):
+        self._cache = cache
+        self._augmentation = augmentation
+        self.batch_size = batch_size
+        self._candidates = np.flatnonzero(np.isin(cache.labels, labels))
+        if len(self._candidates) == 0:
+            raise ValueError(f"No images with labels {labels} in {cache.export_dir}")
+        self._workers = os.cpu_count() if workers is None else workers
+        self._seed = seed
+        self._num_batches = 0
+        self._processes: List[mp.Process] = []
+        self._shm: shared_memory.SharedMemory = None
+        self._slots: np.ndarray = None
+        self._current_slot = None
+        if self._workers > 0:
+            self._start(num_slots=self._workers * prefetch)
+
+    def _next_seed(self) -> int:
+        self._num_batches += 1
+        return self._seed * 1_000_003 + self._num_batches
+
+    def _start(self, num_slots: int):
+        slots_shape = (num_slots, self.batch_size, 2, *self._augmentation.size)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slots_shape)) * np.dtype(np.float32).itemsize)
+        self._slots = np.ndarray(slots_shape, dtype=np.float32, buffer=self._shm.buf)
+        self._tasks, self._done = mp.Queue(), mp.Queue()
+        for _ in range(self._workers):
+            process = mp.Process(
+                target=_worker_loop,
+                args=(
+                    self._cache.path, self._candidates, self._augmentation, self.batch_size,
+                    self._shm.name, slots_shape, self._tasks, self._done,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._processes += [process]
+        for slot in range(num_slots):
+            self._tasks.put((slot, self._next_seed()))
+
+    def batch(self) -> np.ndarray:
+        if self._workers == 0:
+            rng = np.random.default_rng(self._next_seed())
+            idx = np.sort(rng.choice(self._candidates, size=self.batch_size))
+            return self._augmentation(np.asarray(self._cache.images[idx]), rng)
+        # hand the previous slot back to the workers now that the caller is done with it
+        if self._current_slot is not None:
+            self._tasks.put((self._current_slot, self._next_seed()))
+        self._current_slot = self._wait_for_batch()
+        return self._slots[self._current_slot]
+
+    def _wait_for_batch(self) -> int:
+        while True:
+            try:
+                slot, error = self._done.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                dead = [process for process in self._processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"{len(dead)} loader worker(s) exited unexpectedly (exit code {dead[0].exitcode})")
+                continue
+            if error is not None:
+                raise RuntimeError(f"Loader worker failed to build a batch:\n{error}")
+            return slot
+
+    def __iter__(self):
+        while True:
+            yield self.batch()
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=JOIN_TIMEOUT_SECONDS)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
+        if self._shm is not None:
+            self._slots = None
+            try:
+                self._shm.close()
+            except BufferError:
+                # a batch handed out by `batch()` is still referenced; the mapping goes away with it
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()